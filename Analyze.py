@@ -44,7 +44,7 @@ class ProteinAnalyzer:
         """
         ret = {}
         for protein in self.proteins:
-            ret = ret | self.analyze_single_protein(self.proteins[protein])
+            ret.update(self.analyze_single_protein(self.proteins[protein]))
 
         return ret
 
@@ -56,7 +56,7 @@ class ProteinAnalyzer:
         """
         ret = {}
         for mut in protein.muts:
-            ret = ret | self.analyze_single_mutation(mut, protein)
+            ret.update(self.analyze_single_mutation(mut, protein))
 
         return ret
 
@@ -271,15 +271,9 @@ class ProteinAnalyzer:
         :param uid_index: optional set of uids in chunk, can reduce running time
         :return: float AlphaMissense score if found else -1
         """
-        main_uid = mutation.protein.Uid
-        reviewed_uids = mutation.protein.all_uids()['reviewed']
-        if isinstance(reviewed_uids, str):
-            reviewed_uids = [reviewed_uids]
-        variant_location = mutation.loc + offset
-        variant = f"{mutation.origAA}{variant_location}{mutation.changeAA}"
+        variant = self._afm_variant(mutation, offset)
         index = uid_index if uid_index is not None else self.af_index
-        uids = [main_uid] + reviewed_uids if use_alias else [main_uid]
-        for uid in uids:
+        for uid in self.afm_uids(mutation, use_alias):
             if uid in index:
                 idx_from = self.af_index[uid]
                 idx_to = self.af_ranges[str(idx_from)]
@@ -289,6 +283,48 @@ class ProteinAnalyzer:
         # score not found
         return None
 
+    def score_mutations_afm(self, mutations, chunk, offset=0, use_alias=False):
+        """
+        batch version of score_mutation_afm - looks up all mutations in a single chunk at once
+        :param mutations: list of Mutation objects
+        :param chunk: DataFrame of AlphaMissense rows with uniprot_id, protein_variant and am_pathogenicity
+        :param offset: int offset for mutation index
+        :param use_alias: bool should reviewed uid aliases be searched
+        :return: list of float AlphaMissense scores, None where not found
+        """
+        scores = chunk.drop_duplicates(['uniprot_id', 'protein_variant']).set_index(
+            ['uniprot_id', 'protein_variant'])['am_pathogenicity']
+        variants = [self._afm_variant(mutation, offset) for mutation in mutations]
+        candidates = [self.afm_uids(mutation, use_alias) for mutation in mutations]
+        results = [None] * len(mutations)
+        # one vectorized lookup per uid priority, only for mutations still unresolved
+        for rank in range(max(map(len, candidates), default=0)):
+            pending = [i for i, uids in enumerate(candidates) if results[i] is None and rank < len(uids)]
+            if not pending:
+                break
+            keys = pd.MultiIndex.from_arrays([[candidates[i][rank] for i in pending], [variants[i] for i in pending]])
+            for i, score in zip(pending, scores.reindex(keys).to_numpy()):
+                if not np.isnan(score):
+                    results[i] = float(score)
+        return results
+
+    @staticmethod
+    def _afm_variant(mutation, offset=0):
+        return f"{mutation.origAA}{mutation.loc + offset}{mutation.changeAA}"
+
+    @staticmethod
+    def afm_uids(mutation, use_alias=False):
+        """
+        :return: list of uids to search in order of preference - main uid first
+        """
+        main_uid = mutation.protein.Uid
+        if not use_alias:
+            return [main_uid]
+        reviewed_uids = mutation.protein.all_uids()['reviewed']
+        if isinstance(reviewed_uids, str):
+            reviewed_uids = [reviewed_uids]
+        return [main_uid] + reviewed_uids
+
     def score_mutation_esm(self, mut, offset=0):
         """
         :param mut: Mutation object
@@ -1,23 +1,85 @@
-import glob
 from Bio import Entrez, PDB
 from urllib.error import HTTPError as HTTPError
 import re
+import numpy as np
 from definitions import *
-from utils import print_if, warn_if, create_session, safe_post_request, safe_get_request
+from utils import print_if, warn_if, create_session, safe_get_request, ResponseCache, json_loads
 from utils import progress_bar
 import wget
-from os.path import basename
+from concurrent.futures import ThreadPoolExecutor
+from os.path import isfile
+
+
+ISOFORM_HEADER_REGEX = re.compile(r'-(\d+)\|')
+WHITESPACE_TABLE = str.maketrans('', '', ' \t\r\n\v\f')
+
+
+class AlphaModel:
+    """
+    parsed alphafold model, cached in place of the raw pdb response
+    """
+
+    def __init__(self, response):
+        """
+        :param response: requests response of an alphafold pdb file
+        """
+        self.ok, self.status_code = response.ok, response.status_code
+        self._seqres, self._sequence = b'', None  # sequence is decoded only upon request
+        self.locations, self.residues, self.confidences = None, None, None
+        if self.ok:
+            self._seqres = b"\n".join(row for row in response.content.split(b"\n") if row.startswith(b"SEQRES "))
+            self.locations, self.residues, self.confidences = Uniport._atom_records(response.content)
+
+    @property
+    def sequence(self):
+        """
+        :return: str protein sequence of the SEQRES records
+        """
+        if self._sequence is None:
+            self._sequence = Uniport._obtain_seq(self._seqres)
+        return self._sequence
 
 
 class Uniport:
     """
     This class is responsible to connect to online DBs and retrieve information
     """
+    _responses = ResponseCache(HTTP_CACHE_SIZE)  # shared by all instances
+    _models = ResponseCache(ALPHA_MODEL_CACHE_SIZE)  # alphafold models are kept apart as they are much larger
 
     def __init__(self, verbose_level=1):
         Entrez.email = CONTACT
+        Entrez.max_tries = RETRIES
+        Entrez.sleep_between_tries = WAIT_TIME
         self._v = verbose_level
         self.pdpl = PDB.PDBList()
+        self._session = create_session(DEFAULT_HEADER, RETRIES, WAIT_TIME, RETRY_STATUS_LIST,
+                                       pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        releases the pooled connections held by the session
+        """
+        self._session.close()
+
+    def _get(self, url, warning_msg):
+        """
+        GET request that is served from the shared response cache when possible
+        :param url: str url to query
+        :param warning_msg: str msg to display on failure
+        :return: response, None on connection failure
+        """
+        response = self._responses.get(url)
+        if response is None:
+            response = safe_get_request(self._session, url, TIMEOUT, self._v, warning_msg)
+            self._responses.put(url, response)
+        return response
 
     def fetch_uniport_sequences(self, Uid, expend=False):
         """
@@ -28,23 +90,29 @@ class Uniport:
         """
         print_if(self._v, VERBOSE['thread_progress'], "Retrieving isoforms from Uniprt...")
         if not Uid: return ''
-        sequences = {}
-        index = 1
-        s = create_session(DEFAULT_HEADER, RETRIES, WAIT_TIME, RETRY_STATUS_LIST)
-        while True:
-            currentUrl = f"{UNIPORT_URL}{Uid}-{index}.fasta"
-            response = safe_post_request(s, currentUrl, TIMEOUT, self._v, CON_ERR_FUS.format(Uid, currentUrl))
-            if not response:
-                return sequences
-            seq = response.text
-            if not response.ok:
-                print_if(self._v, VERBOSE['thread_progress'], "done")
-                return sequences
-            if not expend:
-                sequences[f"iso_{index}"] = self.remove_whitespaces(seq[seq.find("\n") + 1:])  # remove header
+        query = UNIPORT_QUERY_URL + Q_ISOFORMS_FASTA.format(Uid)
+        r = self._get(query, CON_ERR_FUS.format(Uid) + query)
+        if not r or not r.ok:
+            return {}
+        records = {}
+        canonical = ''
+        for record in r.text.split("\n>"):
+            header, _, seq = record.partition("\n")
+            index = ISOFORM_HEADER_REGEX.search(header)
+            if index is None:  # canonical entry is listed without an isoform index
+                canonical = seq
             else:
-                sequences[f"{Uid}_iso_{index}"] = self.remove_whitespaces(seq[seq.find("\n") + 1:])
-            index += 1
+                records[int(index.group(1))] = seq
+        if canonical:
+            # canonical isoform takes the first index not listed explicitly (usually 1)
+            index = 1
+            while index in records:
+                index += 1
+            records[index] = canonical
+        prefix = f"{Uid}_" if expend else ""
+        sequences = {f"{prefix}iso_{index}": self.remove_whitespaces(records[index]) for index in sorted(records)}
+        print_if(self._v, VERBOSE['thread_progress'], "done")
+        return sequences
 
     def expend_isoforms(self, prot, limit=20, unique_key=''):
         """
@@ -62,19 +130,19 @@ class Uniport:
         else:
             query = UNIPORT_QUERY_URL + Q_ISOFORMS_KEY.format(unique_key)
 
-        s = create_session(DEFAULT_HEADER, RETRIES, WAIT_TIME, RETRY_STATUS_LIST)
-        r = safe_get_request(s, query, TIMEOUT, self._v, CON_ERR_EI.format(prot.name))
+        r = self._get(query, CON_ERR_EI.format(prot.name))
         if not r:
             return {}
         if r.text == '':
             return {}
         uids = r.text.split("\n")
         print_if(self._v, VERBOSE['thread_progress'], f"found {len(uids) - 2} uids")
-        for uid in r.text.split("\n")[1:limit + 1]:
-            if uid == '':
-                return isoforms
-            res = self.fetch_uniport_sequences(uid, expend=True)
-            isoforms = {**isoforms, **res}
+        uids = uids[1:limit + 1]
+        if '' in uids:
+            uids = uids[:uids.index('')]
+        with ThreadPoolExecutor(max_workers=UID_WORKERS) as executor:
+            for res in executor.map(lambda uid: self.fetch_uniport_sequences(uid, expend=True), uids):
+                isoforms.update(res)
         return isoforms
 
     def fetch_pdbs(self, Uid="", prot=None, reviewed=True):
@@ -87,40 +155,50 @@ class Uniport:
         :return: dict {pdb_id: seqence}
         """
         if prot:
-            pdbs = {}
             reviewed = set(prot.all_uids()['reviewed'])
             nreviewed = set(prot.all_uids()['non_reviewed']).difference(reviewed)
-            for uid in reviewed:
-                pdbs = {**pdbs, **self.fetch_pdbs(uid)}
-            if not reviewed:
-                for uid in nreviewed:
-                    pdbs = {**pdbs, **self.fetch_pdbs(uid)}
-            return pdbs
+            uids = reviewed if reviewed else nreviewed
+            # ids of all uids are collected first so sequences are fetched by a single bounded pool
+            with ThreadPoolExecutor(max_workers=UID_WORKERS) as executor:
+                pdbs = {id: uid for uid, ids in zip(uids, executor.map(self._pdb_ids, uids)) for id in ids}
+            return self._pdb_sequences(pdbs)
 
         if not Uid:
             return {}
+        return self._pdb_sequences({id: Uid for id in self._pdb_ids(Uid)})
 
+    def _pdb_ids(self, Uid):
+        """
+        :param Uid: uniport id
+        :return: list of pdb ids known for Uid
+        """
         # params = {'format': 'tab', 'query': 'ID:{}'.format(Uid), 'columns': 'id,database(PDB)'}
-        s = create_session(DEFAULT_HEADER, RETRIES, WAIT_TIME, RETRY_STATUS_LIST)
         query = UNIPORT_QUERY_URL + Q_PDBS_UID.format(Uid)
         print_if(self._v, VERBOSE['thread_progress'], f"Fetching Pdb ids for {Uid}...")
-        r = safe_get_request(s, query, TIMEOUT, self._v, CON_ERR_FP_1.format(Uid))
+        r = self._get(query, CON_ERR_FP_1.format(Uid))
         if not r:
-            return {}
+            return []
         print_if(self._v, VERBOSE['thread_progress'], f"done")
-        pdbs = str(r.text).splitlines()[-1].split('\t')[-1].split(';')[:-1]
+        return str(r.text).splitlines()[-1].split('\t')[-1].split(';')[:-1]
+
+    def _pdb_sequences(self, pdbs):
+        """
+        fetches pdb sequences concurrently with at most PDB_WORKERS requests in flight
+        :param pdbs: dict {pdb_id: uniport id it was found by}
+        :return: dict {pdb_id: seqence}
+        """
         print_if(self._v, VERBOSE['thread_progress'], f"Fetching pdbs sequences...")
-        delta = len(pdbs) / 2  # for proteins with many pdbs default timeout might not be enough
+
+        def fetch(id):
+            return id, self._get(EBI_PDB_URL + f'{id}', CON_ERR_FP_2.format(id, pdbs[id]))
+
         ret = {}
-        # ret = {id: s.get(EBI_PDB_URL + f'{id}', timeout=TIMEOUT + delta).json()[id.lower()][0]['sequence']
-        #      for id in pdbs}
-        for id in pdbs:
-            url = EBI_PDB_URL + f'{id}'
-            value = safe_get_request(s, url, TIMEOUT + delta, CON_ERR_FP_2.format(id, Uid))
-            if not value:
-                continue
-            ret[id] = value.json()[id.lower()][0]['sequence']
-            print_if(self._v, VERBOSE['thread_progress'], f"done")
+        with ThreadPoolExecutor(max_workers=PDB_WORKERS) as executor:
+            for id, value in executor.map(fetch, pdbs):
+                if not value:
+                    continue
+                ret[id] = json_loads(value.content)[id.lower()][0]['sequence']
+        print_if(self._v, VERBOSE['thread_progress'], f"done")
         return ret
 
     def uid_from_name(self, name, all=False, reviewed=True):
@@ -138,9 +216,8 @@ class Uniport:
         else:
             query = UNIPORT_QUERY_URL + Q_UID_PROT.format(name, 'false')
             # params = {'format': 'tab', 'query': f"gene_exact:{name} AND organism:homo_sapiens", 'columns': 'id'}
-        s = create_session(DEFAULT_HEADER, RETRIES, WAIT_TIME, RETRY_STATUS_LIST)
         # r = req.get(query, timeout=TIMEOUT)
-        r = safe_get_request(s, query, TIMEOUT, self._v, CON_ERR_UFN.format(name))
+        r = self._get(query, CON_ERR_UFN.format(name))
         if not r:
             return []
         if r.text == '':
@@ -163,9 +240,8 @@ class Uniport:
 
         name = ref_name if ref_name else protein.name
         url = Q_UNIP_ENTERY.format(name)
-        s = create_session(DEFAULT_HEADER, RETRIES, WAIT_TIME, RETRY_STATUS_LIST)
         # r = req.get(url, timeout=TIMEOUT)
-        r = safe_get_request(s, url, TIMEOUT, self._v, CON_ERR_GENERAL.format('entery_name', name))
+        r = self._get(url, CON_ERR_GENERAL.format('entery_name', name))
         if not r:
             return ''
         if r.text == '':
@@ -185,9 +261,8 @@ class Uniport:
             return []
         search_term = protein.Uid if protein else by_name
         url = Q_UNIP_ENTERY_ALIAS.format(search_term)
-        s = create_session(DEFAULT_HEADER, RETRIES, WAIT_TIME, RETRY_STATUS_LIST)
         # r = req.get(url, timeout=TIMEOUT)
-        r = safe_get_request(s, url, TIMEOUT, self._v, CON_ERR_GENERAL.format('synonms', search_term))
+        r = self._get(url, CON_ERR_GENERAL.format('synonms', search_term))
         if not r:
             return ''
         if r.text == '':
@@ -204,7 +279,7 @@ class Uniport:
             record = self.fetch_NCBI_seq(ncbi_id + f".{idx}")
             if (len(record) == 0) and (idx > 0):
                 return united
-            united = {**united, **record}
+            united.update(record)
             idx += 1
 
     def fetch_NCBI_seq(self, ncbi_id):
@@ -238,53 +313,83 @@ class Uniport:
         """
         returns confidence of alphafold model - if unable to find or model or sequences don't match return -1
         """
-        s = create_session(DEFAULT_HEADER, RETRIES, WAIT_TIME, RETRY_STATUS_LIST)
         # resp = req.get(ALPHAFOLD_PDB_URL.format(prot.Uid), timeout=TIMEOUT)
-        resp = safe_get_request(s, ALPHAFOLD_PDB_URL.format(prot.Uid), TIMEOUT, self._v,
-                                CON_ERR_GENERAL.format('alphafold_confidence', prot.Uid))
-        if not resp:
+        model = self._alpha_model(prot.Uid, 'alphafold_confidence')
+        if not model:
             return -1
-        if not resp.ok:
+        if not model.ok:
             warn_if(self._v, VERBOSE['thread_warnings'], f"Failed to find alphafold model for {prot.Uid}")
             return -1
-        relavent_confidence = [float(i[61:66]) for i in resp.content.split(b"\n") if
-                               i.startswith(b"ATOM  ") and int(i[22:26]) == mut.loc and
-                               AA_SYN[mut.origAA] == i[16:20].decode('utf-8').strip()]
+        locations, residues, confidences = model.locations, model.residues, model.confidences
+        hits = np.flatnonzero((locations == mut.loc) & (residues == AA_SYN[mut.origAA].encode()))
 
-        if len(relavent_confidence) < 1:
+        if hits.size == 0:
             # try to find in sequence assumes reference length of 10
             if not mut.ref_seqs:
                 warn_if(self._v, VERBOSE['thread_warnings'],
                         f"Failed to find residue {mut.origAA} in {mut.loc} -- no ref seqs")
                 return -1
-            sequence = self._obtain_seq(resp)
-            ref = next(iter(mut.ref_seqs.values()))
-            index = sequence.find(ref)
+            index = next((i for i in map(model.sequence.find, mut.ref_seqs.values()) if i != -1), -1)
             if index == -1:
                 warn_if(self._v, VERBOSE['thread_warnings'],
                         f"Faild to find residue {mut.origAA} in {mut.loc} -- can't find reference in sequence")
                 return -1
             # if reference sequence is not 10 need to change "5"
-            relavent_confidence = [float(i[61:66]) for i in resp.content.split(b"\n") if
-                                   i.startswith(b"ATOM  ") and int(i[22:26]) == index + 6]
+            hits = np.flatnonzero(locations == index + 6)
+            if hits.size == 0:
+                warn_if(self._v, VERBOSE['thread_warnings'],
+                        f"Faild to find residue {mut.origAA} in {mut.loc} -- no atom record at {index + 6}")
+                return -1
 
-        return relavent_confidence[0]
+        return float(confidences[hits[0]])
+
+    def _alpha_model(self, Uid, caller):
+        """
+        alphafold model of Uid, parsed once and shared by all mutations of the protein
+        :param Uid: uniport id
+        :param caller: str name of the calling method for the failure warning
+        :return: AlphaModel, None on connection failure
+        """
+        url = ALPHAFOLD_PDB_URL.format(Uid)
+        model = self._models.get(url)
+        if model is None:
+            resp = safe_get_request(self._session, url, TIMEOUT, self._v, CON_ERR_GENERAL.format(caller, Uid))
+            if resp is None:
+                return None
+            model = AlphaModel(resp)
+            self._models.put(url, model)
+        return model
+
+    @staticmethod
+    def _atom_records(content):
+        """
+        parses the fixed width ATOM records of a pdb file into columns
+        :param content: bytes pdb file
+        :return: (residue numbers int array, residue names bytes array, confidences (b-factor) float array)
+        """
+        lines = np.array(content.split(b"\n"))
+        atoms = lines[np.char.startswith(lines, b"ATOM  ")].astype('S80')
+        fields = atoms.view('S1').reshape(-1, 80)
+
+        def column(start, end):
+            return np.char.strip(np.ascontiguousarray(fields[:, start:end]).view(f'S{end - start}').ravel())
+
+        return column(22, 26).astype(np.int32), column(16, 20), column(61, 66).astype(float)
 
     def alpha_seq(self, prot):
-        s = create_session(DEFAULT_HEADER, RETRIES, WAIT_TIME, RETRY_STATUS_LIST)
-        resp = safe_get_request(s, ALPHAFOLD_PDB_URL.format(prot.Uid), TIMEOUT, self._v,
-                                CON_ERR_GENERAL.format('alpha_seq', prot.Uid))
-        if not resp:
+        model = self._alpha_model(prot.Uid, 'alpha_seq')
+        if not model:
             return {}
-        if not resp.ok:
+        if not model.ok:
             return {}
-        return {'alpha': self._obtain_seq(resp)}
+        return {'alpha': model.sequence}
 
-    def _obtain_seq(self, bytefile):
+    @staticmethod
+    def _obtain_seq(content):
         """
-        obtaipns protein sequence from bytefile response
+        obtaipns protein sequence from bytes pdb file
         """
-        seqs = [row[17:].split(b' ')[2:15] for row in bytefile.content.split(b"\n") if row.startswith(b"SEQRES ")]
+        seqs = [row[17:].split(b' ')[2:15] for row in content.split(b"\n") if row.startswith(b"SEQRES ")]
         seqs = [AA_SYN_REV[item.decode('utf-8')] for sublist in seqs for item in sublist if item != b'']
         return "".join(seqs)
 
@@ -295,7 +400,7 @@ class Uniport:
         :param str:
         :return:
         """
-        return re.sub('\s', '', text)
+        return text.translate(WHITESPACE_TABLE)
 
     def download_pdb(self, id, path):
         """
@@ -311,13 +416,11 @@ class Uniport:
         :param prot_names: str
         :return: bool True is successful
         """
-        s = create_session(DEFAULT_HEADER, RETRIES, WAIT_TIME, RETRY_STATUS_LIST)
-        existing_files = {basename(p)[:-4] for p in glob.glob(pjoin(EVE_VARIANTS_PATH, '*.csv'))}
         name = prot_name + '_HUMAN'
-        if name in existing_files:
+        if isfile(pjoin(EVE_VARIANTS_PATH, f'{name}.csv')):
             return True
         url = EVE_SINGLE_PROTEIN.format(name)
-        if s.get(url, timeout=TIMEOUT).ok:
+        if self._session.get(url, timeout=TIMEOUT).ok:
             print_if(self._v, VERBOSE['thread_progress'], EVE_PROT_DOWNLOAD_MSG.format(prot_name))
             for _ in RETRIES:
                 try:
@@ -29,6 +29,7 @@ class Mutation:
         self._change = None
         self._loc = None
         self._full_desc = None
+        self._extended_description = None  # initialized only upon request
         self._protein = None
         self._ref_sequences = None  # initialized only upon request
         self._manual_ref = None
@@ -46,7 +47,7 @@ class Mutation:
             self._create_new_instance(full_desc, protein, dna_data)
             self._save_obj(self._directory)
         else:
-            self._recover_obj(self._directory)
+            self._recover_obj(self._directory, protein)
 
     def __eq__(self, mutatiion):
         """
@@ -110,7 +111,11 @@ class Mutation:
         with open(path, "wb") as file:
             pickle.dump(data, file)
 
-    def _recover_obj(self, path):
+    def _recover_obj(self, path, protein=None):
+        """
+        :param path: path of the saved mutation
+        :param protein: optional Protein object already loaded by the caller, reused if it matches the saved protein
+        """
         with open(path, 'rb') as file:
             if os.path.getsize(path) > 0:
                 data = pickle.load(file)
@@ -120,7 +125,8 @@ class Mutation:
                 # TODO give optional load for missing data
                 self._chr, self._start, self._end, self._orig_NA, self._change_NA  = \
                     data['chr'], data['start'], data['end'], data['orig_NA'], data['change_NA']
-                self._protein = P.Protein(ref_name = data['protein'])
+                self._protein = protein if (protein is not None) and (protein.name == data['protein']) \
+                    else P.Protein(ref_name = data['protein'])
                 if 'manual_ref' in data.keys():  # TODO this is a temporal fix as not all mut objects have this attribute
                     self._manual_ref = data['manual_ref']
             else:
@@ -172,7 +178,9 @@ class Mutation:
 
     @property
     def extended_description(self):
-        return self.extract_name(self._full_desc)
+        if self._extended_description is None:
+            self._extended_description = self.extract_name(self._full_desc)
+        return self._extended_description
 
     @property
     def long_name(self):
@@ -500,9 +508,10 @@ class Mutation:
         :param include_status: bool whether to include esm type and eve type
         :return: list of scores eve, esm, afm in csv format None will be rep;ace with 0 or -1
         """
-        esm_score = self.esm_score if self.esm_score is not None else 0
-        afm_score = self.afm_score if self.afm_score is not None else 0
-        ds_rank = self.ds_rank if self.ds_rank is not None else -1
+        esm_score, afm_score, ds_rank = self.esm_score, self.afm_score, self.ds_rank
+        esm_score = esm_score if esm_score is not None else 0
+        afm_score = afm_score if afm_score is not None else 0
+        ds_rank = ds_rank if ds_rank is not None else -1
         if include_status:
             return [self.protein_name, self.name, self.eve_score, self.eve_type, esm_score,
                     self.esm_type, afm_score, ds_rank]
@@ -7,7 +7,7 @@ import Mutation
 import Analyze
 from Connections import Uniport
 from definitions import *
-from utils import print_if, warn_if
+from utils import print_if, warn_if, _protein_dir
 from copy import deepcopy
 
 
@@ -103,8 +103,9 @@ class Protein:
         generator of all self Mutation objects
         :return:
         """
+        mutation = Mutation.Mutation  # bound once, avoids module lookup per mutation
         for mut_desc in self.mutations:
-            yield Mutation.Mutation(mut_desc, self)
+            yield mutation(mut_desc, self)
 
     @property
     def Uid(self):
@@ -220,6 +221,7 @@ class Protein:
             os.mkdir(self.directory)
         except OSError:
             raise Exception(f"ERROR: FAILED TO CREATE FILE {self.directory}")
+        _protein_dir.cache_clear()  # protein_exists should see the new protein
 
         with open(os.path.join(self.directory, self.UIDS), "w") as file:
             file.write(json.dumps(uids))
@@ -307,6 +309,21 @@ class Protein:
         self._update_DB(os.path.join(self.directory, self.MUTS), self.muts, mode='pickle')
         print_if(self._v, VERBOSE['thread_progress'], f"added {description} to {self._name}")
 
+    def update_scores(self, model, scores):
+        """
+        updates a model score of several mutations with a single DB write
+        :param model: str one of: EVE | ESM | AFM | DS
+        :param scores: dict {mutation name p.{AA}{location}{AA}: float score or None}
+        :return:
+        """
+        assert model in AVAILABLE_SCORES, f"model must be one of {' | '.join(AVAILABLE_SCORES)}"
+        assert all(isinstance(score, (float, int, type(None))) for score in scores.values()), \
+            'score must be either float or None'
+        self.reload()
+        for name, score in scores.items():
+            self.muts[name][MODELS_SCORES[model]] = score
+        self._update_DB(os.path.join(self.directory, self.MUTS), self.muts, mode='pickle')
+
     def find_relevent_pdbs(self, reference_sequence):
         """
         searches know pdbs that contain the reference sequence
@@ -39,6 +39,12 @@ WAIT_TIME = 1.0
 RETRIES = 10
 RETRY_STATUS_LIST = [429, 500, 502, 503, 504]
 DEFAULT_HEADER = "https://"
+POOL_CONNECTIONS = 20
+POOL_MAXSIZE = 50
+PDB_WORKERS = 32  # concurrent EBI requests per protein
+UID_WORKERS = 16  # concurrent Uniprot ids queried per protein
+HTTP_CACHE_SIZE = 1024  # responses kept in memory by Uniport
+ALPHA_MODEL_CACHE_SIZE = 16  # parsed alphafold models kept in memory, bounded apart from HTTP_CACHE_SIZE
 
 #  MEMORY CONSTANTS
 
@@ -57,6 +63,7 @@ ALPHAFOLD_PDB_URL = "https://alphafold.ebi.ac.uk/files/AF-{}-F1-model_v1.pdb"
 
 Q_ISOFORMS_PROT = "fields=id&format=tsv&query=gene_exact:{}+AND+organism_id:9606"
 Q_ISOFORMS_KEY = "fields=id&format=tsv&query={}+AND+organism_id:9606"
+Q_ISOFORMS_FASTA = "format=fasta&includeIsoforms=true&size=500&query=accession:{}"
 Q_PDBS_UID = "fields=id,xref_pdb&format=tsv&query={}"
 #  first protein ref name, second true/false
 Q_UID_PROT = "fields=&id&format=tsv&query={}+AND+organism_id:9606+AND+reviewed:{}"
@@ -126,10 +133,13 @@ AFM_DIRECTORY = 'index.json'
 AFM_RANGES = 'ranges.json'
 AFM_DIRECTORY_PATH = pjoin(AFM_PATH, AFM_DIRECTORY)
 AFM_RANGES_PATH = pjoin(AFM_PATH, AFM_RANGES)
+AFM_OFFSETS = 'offsets.json'
+AFM_OFFSETS_PATH = pjoin(AFM_PATH, AFM_OFFSETS)
 AFM_HEADER = 3
 AFM_COL_NAMES = ['uniprot_id', 'protein_variant', 'am_pathogenicity', 'am_class']
 AFM_ROWSIZE = 32.0
 AFM_UID_ROWSIZE = 8.0
+AFM_MAX_BLOCK_SIZE = 1 << 30  # pyarrow csv block size limit is int32
 AF_ISO_NAME = 'alpha'
 AFM_ROWS = 216175351
 
@@ -182,3 +192,4 @@ ESM_FILE_SUFFIX = '_LLR.csv'
 #  DSRANK AND SUMMARY
 EVE_COL, EVE_TYPE_COL, ESM_COL, ESM_TYPE_COL, AFM_COL, DS_COL = "eve", "eve_type", "esm", "esm_type", "afm", "ds_rank"
 PROT_COL, MUT_COL = 'protein', 'variant'
+SUMMARY_CHUNKSIZE = 1 << 16  # rows per to_csv write
@@ -1,16 +1,17 @@
 import Analyze
-from Mutation import Mutation
 from Protein import Protein
+from Mutation import Mutation
 import pandas as pd
 import os
 import argparse
+import json
 from multiprocessing import cpu_count
-from multiprocessing.pool import ThreadPool as Pool
+from concurrent.futures import ProcessPoolExecutor
 import tqdm
 from functools import partial
-from utils import print_if, adaptive_chunksize, afm_iterator, warn_if, summary_df
+from utils import print_if, adaptive_chunksize, afm_iterator, afm_block_size, afm_offsets_batches, afm_offsets_read
+from utils import warn_if, summary_df, silent_remove, _protein_dir
 from definitions import *
-import glob
 from math import ceil
 import numpy as np
 
@@ -19,15 +20,15 @@ def all_proteins():
     """
     :return: iterable of all Protein objects in DB
     """
-    for path in glob.glob(os.path.join(PROTEIN_PATH, '*')):
-        prot_name = os.path.basename(path)
+    with os.scandir(PROTEIN_PATH) as entries:
+        names = [entry.name for entry in entries if not entry.name.startswith('.')]
+    for prot_name in names:
         yield Protein(ref_name=prot_name)
 
 
 def all_mutations():
     for prot in all_proteins():
-        for mutation in prot.generate_mutations():
-            yield mutation
+        yield from prot.generate_mutations()
 
 
 def create_parser():
@@ -191,67 +192,75 @@ def create_parser():
     return parser
 
 
-def create_new_records(args, *rowiters):
+def create_new_records(args, rows):
     """
     creates protein and mutation object from csv row
     :param args: user arguments
-    :param rowiter: DataFrame rows iterator
-    :return: bool success
+    :param rows: DataFrame rows of a single protein
+    :return: list of skipped records (row index, mutation path to remove or None)
     """
-    idxs = [t[0] for t in rowiters]
-    rows = [t[1] for t in rowiters]
-    rowiter = zip(idxs, rows)
     skipped = []
-    created_protein = None
-    for idx, row in rowiter:
-        gene = row[args.protein_col]
-        mut_desc = row[args.variant_col]
-        dna = {'chr': row[args.chromosome_col], 'start': row[args.dna_start_col], 'end': row[args.dna_end_col],
-               'ref_na': row[args.wt_col], 'alt_na': row[args.alt_col]}
+    protein = None
+    protein_col, variant_col, verbose = args.protein_col, args.variant_col, args.verbose
+    gene = rows[protein_col].iloc[0]
+    prot_name = PROTEIN_ALIASES.get(gene, gene)  # resolved as in Protein
+    protein_path = pjoin(PROTEIN_PATH, prot_name)
+    new_protein = not os.path.exists(protein_path)  # only a protein created by this task may be removed
+    dna_cols = {'chr': args.chromosome_col, 'start': args.dna_start_col, 'end': args.dna_end_col,
+                'ref_na': args.wt_col, 'alt_na': args.alt_col}
+    for pos, (idx, row) in enumerate(rows.iterrows()):
+        gene = row[protein_col]
+        mut_desc = row[variant_col]
+        dna = {key: row[col] for key, col in dna_cols.items()}
         try:
-            protein = Protein(ref_name=gene, verbose_level=args.verbose) if not created_protein else created_protein
-            created_protein = protein
+            protein = Protein(ref_name=gene, verbose_level=verbose) if protein is None else protein
             protein.add_mut(mut_desc, dna)
         except TimeoutError:
             print_if(args.verbose, VERBOSE['thread_warnings'], f"skipped {gene} due to timeout")
-            os.remove(rf'DB\test_p\{gene}')
-            os.remove(rf'DB\test_m\{gene}_{mut_desc}.txt')
-            skipped.append(idx)
+            if protein is None:
+                # the protein is partial and can't be loaded again - drop it and skip the rest of its rows
+                if new_protein:
+                    silent_remove(protein_path)
+                    _protein_dir.cache_clear()
+                skipped += [(i, None) for i in rows.index[pos:]]
+                break
+            try:
+                mutation_path = pjoin(MUTATION_PATH, f'{prot_name}_{Mutation.extract_name(mut_desc)}.txt')
+            except ValueError:
+                mutation_path = None
+            skipped.append((idx, mutation_path))
     return skipped
 
 
 def to_csv(include_type=False, outpath=''):
-    df = summary_df(include_status=include_type)
-    for mutation in all_mutations():
-        df.loc[len(df)+1] = mutation.scores_to_csv(include_status=include_type)
+    rows = [mutation.scores_to_csv(include_status=include_type) for mutation in all_mutations()]
+    df = pd.DataFrame(rows, columns=summary_df(include_status=include_type).columns, index=range(1, len(rows) + 1))
     df.replace(0, np.nan, inplace=True)
     df.replace(-1, np.nan, inplace=True)
     if outpath:
-        df.to_csv(outpath)
+        df.to_csv(outpath, chunksize=SUMMARY_CHUNKSIZE)
     return df
 
 
 def build_db(args, target, workers):
     skipped = []
     df = pd.read_csv(args.data_path)
-    values_iter = lambda value, data: data[data[args.protein_col] == value].iterrows()
-
-    # tasks are per-protein iterators to prevent race conditions
-    # in proteins with multiple mutations
-    unique_rows = df[~df[args.protein_col].duplicated(keep=False)]
-    unique_proteins = unique_rows[args.protein_col].unique()
-    tasks_unique = [values_iter(value, unique_rows) for value in unique_proteins]
-
-    repeating_rows = df[df[args.protein_col].duplicated(keep=False)]
-    repeating_proteins = repeating_rows[args.protein_col].unique()
-    tasks_repeating = [values_iter(value, repeating_rows) for value in repeating_proteins]
-
-    tasks = tasks_repeating + tasks_unique
+    # tasks are per-protein row groups to prevent race conditions
+    # in proteins with multiple mutations, proteins with most mutations first
+    groups = [rows for _, rows in df.groupby(args.protein_col, sort=False)]
+    tasks = sorted(groups, key=len, reverse=True)
     print_if(args.verbose, VERBOSE['program_progress'], f"Building protein database...")
-    with Pool(workers) as p:
-        for status in p.starmap(target, tasks):
-            if status:  # if failed will return row index
-                skipped += status
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for status in executor.map(target, tasks):
+                if status:  # if failed will return skipped records
+                    skipped += status
+    finally:
+        # partial records of skipped rows are removed once workers are done, also when one of them failed
+        for _, mutation_path in skipped:
+            if mutation_path:
+                silent_remove(mutation_path)
+    skipped = [idx for idx, _ in skipped]
 
     if args.verbose >= VERBOSE['program_progress']:
         if not skipped:
@@ -277,32 +286,37 @@ def erase_mutations_scores(model):
     print_if(args.verbose, VERBOSE['program_progress'], f"{model} scores set to default")
 
 
-def calc_mutations_afm_scores(args, analyzer, chunk=None, iter_desc='', use_alias=False):
+def calc_mutations_afm_scores(args, analyzer, tasks, chunk=None, iter_desc='', use_alias=False, alias_scores=None):
     """
-    calculates Alpha Missense scores for all the mutations of a specific protein
-    :param recalc: bool re-calculate scored for mutations with available scores
+    calculates Alpha Missense scores for the given mutations
     :param use_alias: bool should reviewed uid aliases be searched
     :param args:
     :param analyzer: ProteinAnalyzer object
+    :param tasks: list of Mutations without Alpha Missense scores
     :param chunk: optional df chunk to search mutation in
-    :param mutations: Iterator of Mutations
-    :return:
+    :param alias_scores: optional dict {Mutation: score}, if given mutations left unresolved are also searched by
+                        their aliases in the same chunk. first score found is kept but not saved
+    :return: list of Mutations that remain without scores
     """
-    successful = 0
-    tasks = [mut for mut in all_mutations() if not mut.has_afm]
     if not tasks:
-        return successful
-    n_muts = len(tasks)
+        return tasks
     if chunk is not None:
-        uid_index = set(chunk['uniprot_id'].unique())
-    for mutation in tqdm.tqdm(tasks, desc=iter_desc, total=n_muts):
-        print_if(args.verbose, VERBOSE['thread_progress'], f"Calculating AlphaMissense scores for {mutation.long_name}")
-        score = analyzer.score_mutation_afm(mutation, chunk=chunk, uid_index=uid_index, use_alias=use_alias)
-        successful += score is not None
+        scores = analyzer.score_mutations_afm(tasks, chunk, use_alias=use_alias)
+    else:
+        scores = [analyzer.score_mutation_afm(mutation, use_alias=use_alias) for mutation in tasks]
+    unresolved = []
+    for mutation, score in tqdm.tqdm(zip(tasks, scores), desc=iter_desc, total=len(tasks)):
+        if score is None:
+            unresolved.append(mutation)
+            continue
+        print_if(args.verbose, VERBOSE['thread_progress'], f"Found AlphaMissense score for {mutation.long_name}")
         mutation.update_score('AFM', score)
-        if successful == n_muts:
-            return successful
-    return successful
+    if alias_scores is not None and chunk is not None:
+        pending = [mutation for mutation in unresolved if mutation not in alias_scores]
+        for mutation, score in zip(pending, analyzer.score_mutations_afm(pending, chunk, use_alias=True)):
+            if score is not None:
+                alias_scores[mutation] = score
+    return unresolved
 
 
 def calc_mutations_eve_scores(args, analyzer, recalc=False, iter_desc='', impute=True):
@@ -382,11 +396,11 @@ def calc_mutations_dsrank(n_scores_thr):
     df[ESM_COL] = 1 - df[ESM_COL]
     df['n_scores'] = df[[EVE_COL, ESM_COL, AFM_COL]].count(axis=1, numeric_only=False)
     df[DS_COL] = (df[EVE_COL].fillna(0) + df[ESM_COL].fillna(0) + df[AFM_COL].fillna(0)) / df['n_scores']
-    for _, row in df.iterrows():
-        protein = Protein(ref_name=row[PROT_COL])
-        mutation = Mutation(f"p.{row[MUT_COL]}", protein)
-        score = None if row['n_scores'] < n_scores_thr else float(row[DS_COL])
-        mutation.update_score(model='DS', score=score)
+    # one DB write per protein instead of one per mutation
+    for prot_name, rows in df.groupby(PROT_COL, sort=False):
+        scores = {f"p.{mut}": None if n_scores < n_scores_thr else float(score)
+                  for mut, n_scores, score in zip(rows[MUT_COL], rows['n_scores'], rows[DS_COL])}
+        Protein(ref_name=prot_name).update_scores(model='DS', scores=scores)
     # change all values under thr to nan
     df.loc[df['n_scores'] < n_scores_thr, DS_COL] = np.nan
     df.drop('n_scores', axis=1, inplace=True)
@@ -405,23 +419,41 @@ def main(args):
             return skipped
         if action == 'score-AFM':
             chunksize = adaptive_chunksize(AFM_ROWSIZE, LOW_MEM_RAM_USAGE)
-            n_muts, iter_num, total_iter, total_scores =len(glob.glob(pjoin(MUTATION_PATH, '*.txt'))), 1, \
-                                                        ceil(AFM_ROWS / chunksize), 0
+            iter_num = 1
             if args.recalc:
                 erase_mutations_scores('AFM')
 
+            # mutations are loaded once and dropped from tasks as soon as they are scored
+            mutations = list(all_mutations())
+            tasks = [mutation for mutation in mutations if not mutation.has_afm]
+            n_muts, n_tasks = len(mutations), len(tasks)
+            # only rows of proteins that still need scores are converted to pandas
+            afm_uids = {uid for mutation in tasks for uid in analyzer.afm_uids(mutation, use_alias=True)}
             print_if(args.verbose, VERBOSE['program_progress'], f"Calculating AlphaMissense scores...")
-            for chunk in afm_iterator(int(chunksize), usecols=['uniprot_id', 'protein_variant', 'am_pathogenicity']):
-                total_scores += calc_mutations_afm_scores(args, analyzer, chunk, f'iter {iter_num} of {total_iter} ',
-                                                     use_alias=False)
-                iter_num += 1
-            # Second run with aliases for mutations without scores
-            print_if(args.verbose, VERBOSE['program_progress'], f"Expending search for unresolved mutations...")
-            iter_num = 1
-            for chunk in afm_iterator(int(chunksize), usecols=['uniprot_id', 'protein_variant', 'am_pathogenicity']):
-                total_scores += calc_mutations_afm_scores(args, analyzer, chunk, f'iter {iter_num} of {total_iter}',
-                                                     use_alias=True)
+            usecols = ['uniprot_id', 'protein_variant', 'am_pathogenicity']
+            if os.path.exists(AFM_OFFSETS_PATH):
+                # seek directly to the rows of the relevant proteins instead of scanning the whole table
+                with open(AFM_OFFSETS_PATH, 'r') as file:
+                    offsets = json.load(file)
+                batches = afm_offsets_batches([offsets[uid] for uid in afm_uids if uid in offsets],
+                                              int(chunksize * AFM_ROWSIZE))
+                chunks = (afm_offsets_read(batch, usecols=usecols) for batch in batches)
+                total_iter = len(batches)
+            else:
+                chunks = afm_iterator(int(chunksize), usecols=usecols, uids=afm_uids)
+                total_iter = ceil(os.path.getsize(AFM_DATA_PATH) / afm_block_size(int(chunksize)))
+            # single pass, aliases are searched in the same chunk but direct scores are always preferred
+            alias_scores = {}
+            for chunk in chunks:
+                tasks = calc_mutations_afm_scores(args, analyzer, tasks, chunk, f'iter {iter_num} of {total_iter} ',
+                                                  use_alias=False, alias_scores=alias_scores)
                 iter_num += 1
+            print_if(args.verbose, VERBOSE['program_progress'], f"Using aliases for unresolved mutations...")
+            for mutation in tasks:
+                if mutation in alias_scores:
+                    mutation.update_score('AFM', alias_scores[mutation])
+            tasks = [mutation for mutation in tasks if mutation not in alias_scores]
+            total_scores = n_tasks - len(tasks)
             print_if(args.verbose, VERBOSE['program_progress'], f"done, scored {total_scores} of {n_muts} mutations")
         if action == 'score-EVE':
             print_if(args.verbose, VERBOSE['program_progress'], f"Calculating EVEmodel scores...")
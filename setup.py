@@ -38,6 +38,30 @@ def create_afm_index():
     print('done')
 
 
+def create_afm_offsets():
+    """
+    maps every uniprot id to the byte range [offset, length] of its rows in the AlphaMissense data
+    rows of the same protein are contiguous in the source file, first range is kept on repeats
+    """
+    offsets = {}
+    print('building Alpha Missense offsets index...')
+    with open(AFM_DATA_PATH, 'rb') as file:
+        position = sum(len(file.readline()) for _ in range(AFM_HEADER + 1))  # comments and header
+        current, start = None, position
+        for line in file:
+            uid = line[:line.find(b'\t')]
+            if uid != current:
+                if current is not None and current not in offsets:
+                    offsets[current] = [start, position - start]
+                current, start = uid, position
+            position += len(line)
+        if current is not None and current not in offsets:
+            offsets[current] = [start, position - start]
+    with open(AFM_OFFSETS_PATH, "w") as file:
+        file.write(json.dumps({uid.decode(): value for uid, value in offsets.items()}))
+    print('done')
+
+
 def create_esm_index():
     df = pd.read_csv(pjoin(ESM_DATA_PATH, 'contents_u_df.csv'))
     index = {row['gene']: row['id'] for _, row in df.iterrows()}
@@ -137,6 +161,7 @@ def main():
     create_directories()
     download_afm()
     create_afm_index()
+    create_afm_offsets()
     download_esm()
     create_esm_index()
     download_eve()
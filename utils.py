@@ -1,4 +1,5 @@
 import os
+import shutil
 from pathlib import Path
 import warnings
 import requests
@@ -7,10 +8,21 @@ from definitions import *
 import sys
 import psutil
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv as pa_csv
 import gzip
+from io import BytesIO
 import hashlib
 from tqdm import tqdm
 import click
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+try:
+    from orjson import loads as json_loads
+except ImportError:  # orjson is optional
+    from json import loads as json_loads
 
 
 def print_if(verbose: object, thr: object, text: object) -> object:
@@ -37,24 +49,74 @@ def warn_if(verbose, thr, text):
         warnings.warn(text)
 
 
-def create_session(header, retries=5, wait_time=0.5, status_forcelist=None):
+def create_session(header, retries=5, wait_time=0.5, status_forcelist=None, pool_connections=10, pool_maxsize=10):
     """
     Creates a session using pagination
     :param header: str url header session eill apply to
     :param retries: int number of retries on failure
     :param wait_time: float time (sec) between attempts
     :param status_forcelist: list HTTP status codes that we should force a retry on
+    :param pool_connections: int number of hosts to keep connection pools for
+    :param pool_maxsize: int max number of kept-alive connections per host
     :return: requests session
     """
     s = requests.Session()
+    s.headers.update(HEADERS)
+    # POST is not retried by default. on exhaustion the last response is returned instead of raising
     retries = Retry(total=retries,
                     backoff_factor=wait_time,
-                    status_forcelist=status_forcelist)
+                    status_forcelist=status_forcelist,
+                    allowed_methods=['GET', 'POST'],
+                    respect_retry_after_header=True,
+                    raise_on_status=False)
 
-    s.mount(header, HTTPAdapter(max_retries=retries))
+    s.mount(header, HTTPAdapter(max_retries=retries, pool_connections=pool_connections, pool_maxsize=pool_maxsize))
     return s
 
 
+class ResponseCache:
+    """
+    thread safe LRU cache of responses keyed by url
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        :param maxsize: int max number of responses kept
+        """
+        self._maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        """
+        :param url: str
+        :return: cached response, None if missing
+        """
+        with self._lock:
+            if url not in self._data:
+                return None
+            self._data.move_to_end(url)
+            return self._data[url]
+
+    def put(self, url, response):
+        """
+        caches response unless the request failed or should be retried
+        :param url: str
+        :param response: requests response obj, or any object exposing its status_code
+        """
+        if response is None or response.status_code in RETRY_STATUS_LIST:
+            return
+        with self._lock:
+            self._data[url] = response
+            self._data.move_to_end(url)
+            if len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
 def progress_bar(current, total, width=80):
     progress_message = "Downloading: %d%% [%d / %d] bytes" % (current / total * 100, current, total)
     sys.stdout.write("\r" + progress_message)
@@ -111,9 +173,8 @@ def safe_post_request(session, url, timeout, verbose_level, warning_msg='connect
 
 def make_fasta(path, name, seq):
     full_path = os.path.join(path, f"{name}.fasta")
-    with open(full_path, "w+") as file:
-        file.write(f">{name}\n")
-        file.write(f"{seq}\n")
+    with open(full_path, "wb", buffering=0) as file:
+        file.write(f">{name}\n{seq}\n".encode('utf-8'))
 
 
 def adaptive_chunksize(rowsize, ram_usage=0.5):
@@ -128,15 +189,43 @@ def adaptive_chunksize(rowsize, ram_usage=0.5):
     return available // rowsize
 
 
-def afm_iterator(chunksize, usecols=None):
+def afm_block_size(chunksize):
     """
-    :param chunksize: int
-    :param usecols: Sequence of Hashable or Callable, optional. Subset of columns to select,
-    :yields: DataFrame of size chuksize
+    :param chunksize: int approximate number of rows in chunk
+    :return: int bytes read per afm_iterator chunk, capped by the pyarrow block size limit
     """
-    for chunk in pd.read_csv(AFM_DATA_PATH, sep='\t', chunksize=chunksize,
-                             header=AFM_HEADER, usecols=usecols):
-        yield chunk
+    return int(min(chunksize * AFM_ROWSIZE, AFM_MAX_BLOCK_SIZE))
+
+
+def afm_iterator(chunksize, usecols=None, uids=None):
+    """
+    streams AlphaMissense data using pyarrow record batches
+    :param chunksize: int approximate number of rows in chunk
+    :param usecols: list of str, optional. Subset of columns to select,
+    :param uids: optional collection of uniprot ids, rows of other proteins are dropped before conversion to pandas.
+                requires 'uniprot_id' in usecols
+    :yields: DataFrame of about chuksize rows indexed by row number in the source file
+    """
+    block_size = afm_block_size(chunksize)
+    # memory mapped so blocks are parsed straight from the page cache without an extra read copy
+    # the map is closed when the generator finishes or is closed early
+    with pa.memory_map(AFM_DATA_PATH, 'r') as source:
+        reader = pa_csv.open_csv(source,
+                                 read_options=pa_csv.ReadOptions(skip_rows=AFM_HEADER, block_size=block_size),
+                                 parse_options=pa_csv.ParseOptions(delimiter='\t'),
+                                 convert_options=pa_csv.ConvertOptions(include_columns=usecols))
+        value_set = pa.array(list(uids), type=pa.string()) if uids is not None else None
+        start = 0
+        for batch in reader:
+            index = pd.RangeIndex(start, start + batch.num_rows)
+            start += batch.num_rows
+            if value_set is not None:
+                mask = pc.is_in(batch.column('uniprot_id'), value_set=value_set)
+                index = index[mask.to_numpy(zero_copy_only=False)]
+                batch = batch.filter(mask)
+            chunk = batch.to_pandas()
+            chunk.index = index
+            yield chunk
 
 
 def afm_range_read(idx_from, idx_to, usecols=None):
@@ -145,6 +234,43 @@ def afm_range_read(idx_from, idx_to, usecols=None):
                        nrows=nrows, usecols=usecols)
 
 
+def afm_offsets_batches(ranges, max_bytes):
+    """
+    groups byte ranges into batches that are read and scored together
+    :param ranges: list of [offset, length] as stored in AFM_OFFSETS_PATH
+    :param max_bytes: int max bytes per batch, a single range larger than max_bytes is a batch of its own
+    :return: list of batches, each a list of [offset, length]
+    """
+    batches, batch, size = [], [], 0
+    for offset, length in sorted(ranges):
+        if batch and size + length > max_bytes:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append([offset, length])
+        size += length
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def afm_offsets_read(ranges, usecols=None):
+    """
+    reads the AlphaMissense rows found in the given byte ranges
+    :param ranges: list of [offset, length] as stored in AFM_OFFSETS_PATH
+    :param usecols: list of str, optional. Subset of columns to select
+    :return: DataFrame
+    """
+    with open(AFM_DATA_PATH, 'rb') as file:
+        parts = []
+        for offset, length in sorted(ranges):
+            file.seek(offset)
+            parts.append(file.read(length))
+    data = b''.join(parts)
+    if not data:
+        return pd.DataFrame(columns=usecols if usecols else AFM_COL_NAMES)
+    return pd.read_csv(BytesIO(data), sep='\t', names=AFM_COL_NAMES, usecols=usecols)
+
+
 def ugzip(path, outfile, chunksize):
     """
     unzips .gz file in chunks
@@ -171,8 +297,30 @@ def sequence_from_esm_df(esm_data):
     return ''.join([desc[0] for desc in esm_data.columns.to_list()[1:]])
 
 
+@lru_cache(maxsize=1)
+def _protein_dir():
+    """
+    names of all proteins in the DB, scanned once per process - cleared whenever a protein directory is created or removed
+    :return: frozenset of protein names
+    """
+    with os.scandir(PROTEIN_PATH) as entries:
+        return frozenset(entry.name for entry in entries)
+
+
 def protein_exists(ref_name):
-    return ref_name in set(os.listdir('DB/proteins'))
+    return ref_name in _protein_dir()
+
+
+def silent_remove(path):
+    """
+    removes a file or a directory tree, missing paths are ignored
+    :param path: str
+    :return:
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
 
 
 def summary_df(include_status=False):